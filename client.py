@@ -1,8 +1,19 @@
 import os
+import sys
+import json
+import hashlib
+from collections import OrderedDict
 from dotenv import load_dotenv
 from openai import OpenAI
 import re # Need re for parsing
 
+# Optional dependency: numpy powers the semantic routing cache.
+# Without it every dispatcher turn simply goes through the LLM as before.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # --- Environment Setup ---
 # Load environment variables from .env file (especially API keys and endpoints)
 load_dotenv()
@@ -11,6 +22,7 @@ load_dotenv()
 api_key = os.getenv('OPENAI_API_KEY')
 base_url = os.getenv('BASE_URL') # Potentially a non-OpenAI endpoint
 chat_model = os.getenv('CHAT_MODEL') # The specific LLM to use
+embed_model = os.getenv('EMBED_MODEL', 'text-embedding-3-small') # Embedding model for semantic routing
 
 # Initialize the OpenAI client with the specified API key and base URL
 # This client will be used for all interactions with the LLM
@@ -19,6 +31,111 @@ client = OpenAI(
     base_url = base_url
 )
 
+# --- LLM Response Cache ---
+# In-process exact-match cache for routing calls. Dispatcher turns in the
+# "system" state are highly repetitive (the same request phrasing routes to
+# the same worker), so identical calls are served from memory instead of
+# paying a full LLM round-trip. Only pure routing turns are cached; worker
+# states carry transient task context and must always hit the API.
+_LLM_CACHE = {}
+
+def _cache_key(messages):
+    """Builds a stable cache key from the model name and message list."""
+    payload = json.dumps([chat_model, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8")).hexdigest()
+
+# --- Semantic Routing Cache ---
+# Dispatcher turns almost always produce one of four outcomes (route to a
+# worker, or a normal reply). Paraphrases of the same request should route
+# identically, so we compare the user utterance against canonical phrasings
+# by embedding similarity and, on a confident match, skip the dispatcher
+# LLM call entirely.
+
+# Canonical phrasings for each worker intent
+_CANONICAL_INTENTS = (
+    ("我想注册一个新账号", "registered"),
+    ("帮我注册一个账号", "registered"),
+    ("I want to register a new account", "registered"),
+    ("我想查询我的账户信息", "query"),
+    ("帮我查一下我的用户数据", "query"),
+    ("I want to look up my account information", "query"),
+    ("我想删除我的账号", "delete"),
+    ("帮我注销我的账户", "delete"),
+    ("I want to delete my account", "delete"),
+)
+
+# Minimum cosine similarity for a semantic routing hit
+_SEMANTIC_THRESHOLD = 0.85
+
+# Keyword patterns for local intent routing - the cheapest routing tier.
+# A turn whose utterance matches exactly one of these routes straight to
+# that worker with no network call at all; ambiguous or unmatched turns
+# fall through to the embedding-based semantic cache and then to the
+# dispatcher LLM.
+_INTENT_PATTERNS = (
+    ("registered", re.compile(r"注册|register|sign\s*up", re.IGNORECASE)),
+    ("delete",     re.compile(r"删除|注销|delete|remove", re.IGNORECASE)),
+    ("query",      re.compile(r"查询|查一下|query|look\s*up", re.IGNORECASE)),
+)
+
+# --- Parsing Patterns ---
+# All regexes used to parse the LLM's structured output are compiled once
+# at import time, so the hot parsing path never pays the re-module cache
+# lookup per call.
+
+# Literal markers opening the structured payload in each task's final
+# response. They are fixed strings, so plain str.find locates the payload
+# with two C-level scans instead of running the regex engine over the
+# whole LLM response.
+_REG_MARK = "用户信息：["
+_QUERY_MARK = "查询条件：["
+_DELETE_MARK = "删除条件：["
+
+def _extract_marked(text, marker):
+    """Slices out the payload between `marker` and the closing ']'.
+       Returns the payload string, or None if either is absent."""
+    i = text.find(marker)
+    if i < 0:
+        return None
+    start = i + len(marker)
+    j = text.find("]", start)
+    if j < 0:
+        return None
+    return text[start:j]
+
+# Combined patterns matching every field of a payload in one pass. The
+# field order is fixed by the prompts, so a single regex invocation
+# replaces one search per field on the fast path.
+_REG_ALL = re.compile(
+    r"姓名:\s*(?P<name>\S+).*?性别:\s*(?P<gender>\S+).*?年龄:\s*(?P<age>\d+)"
+    r".*?密码:\s*(?P<password>\S+).*?邮箱:\s*(?P<email>\S+@\S+\.\S+)", re.DOTALL)
+_QUERY_ALL = re.compile(
+    r"用户ID:\s*(?P<user_id>\d+).*?密码:\s*(?P<password>\S+)", re.DOTALL)
+_DELETE_ALL = re.compile(
+    r"用户ID:\s*(?P<user_id>\d+).*?密码:\s*(?P<password>\S+)"
+    r".*?邮箱:\s*(?P<email>\S+@\S+\.\S+)", re.DOTALL)
+
+# Per-field patterns, used as a fallback when the model emits the fields
+# in an unexpected order and the combined pattern does not match. Stored
+# as tuples of (key, pattern) pairs: iteration is a tight C-level walk
+# over a fixed sequence, with no dict view objects allocated per parse.
+_REG_FIELDS = (
+    ("name",     re.compile(r"姓名:\s*(\S+)")),
+    ("gender",   re.compile(r"性别:\s*(\S+)")),
+    ("age",      re.compile(r"年龄:\s*(\d+)")),
+    ("password", re.compile(r"密码:\s*(\S+)")),
+    ("email",    re.compile(r"邮箱:\s*(\S+@\S+\.\S+)")),
+)
+_QUERY_FIELDS = (
+    ("user_id",  re.compile(r"用户ID:\s*(\d+)")),
+    ("password", re.compile(r"密码:\s*(\S+)")),
+)
+_DELETE_FIELDS = (
+    ("user_id",  re.compile(r"用户ID:\s*(\d+)")),
+    ("password", re.compile(r"密码:\s*(\S+)")),
+    ("email",    re.compile(r"邮箱:\s*(\S+@\S+\.\S+)")),
+)
+
 # --- Prompt Engineering ---
 # Define the system prompts that guide the LLM's behavior for different tasks.
 
@@ -30,46 +147,128 @@ sys_prompt = """你是一个聪明的客服。您将能够根据用户的问题
 3.删除用户数据。如果用户想执行这种类型的操作，您应该发送一个带有"delete workers"的特殊令牌。并告诉用户您正在调用它。
 """
 
-# Prompt for the registration process: instructs the LLM on what information to collect,
-# how to confirm it, and the specific format to output the collected data in before finishing.
-# The format "用户信息：[...]" is crucial for later parsing.
+# The worker prompts below instruct the LLM to respond with a structured
+# JSON object on every turn: {"done": bool, "message": str, "info": {...}}.
+# Structured output removes the brittle free-text template parsing from the
+# hot path - a single stray character no longer wastes the whole API call.
+# The legacy marker formats ("用户信息：[...]" etc.) are still parsed as a
+# fallback for models that ignore the JSON instruction.
+
+# Prompt for the registration process: instructs the LLM on what information
+# to collect and the JSON object to reply with on every turn.
 registered_prompt = """
 您的任务是根据用户信息存储数据。您需要从用户那里获得以下信息：
 1.用户名、性别、年龄 (例如：姓名: 张三, 性别: 男, 年龄: 25)
 2.用户设置的密码 (例如：密码: password123)
 3.用户的电子邮件地址 (例如：邮箱: zhangsan@example.com)
 如果用户没有提供此信息，您需要提示用户提供。收集完所有信息后，请确认信息并准备存储。
-最后，请明确告知用户注册成功，并按照以下格式包含用户信息：
-'注册成功！用户信息：[姓名: <姓名>, 性别: <性别>, 年龄: <年龄>, 密码: <密码>, 邮箱: <邮箱>]'
-然后回复带有 "customer service" 的特殊令牌，以结束任务。
+您的每次回复都必须是一个 JSON 对象。信息收集过程中请回复：
+{"done": false, "message": "<发给用户的回复>"}
+收集并确认完所有信息后，请将 done 设为 true，并在 info 中包含完整的用户信息以结束任务：
+{"done": true, "message": "注册成功！", "info": {"name": "<姓名>", "gender": "<性别>", "age": <年龄>, "password": "<密码>", "email": "<邮箱>"}}
 """
 
-# Prompt for the query process: instructs the LLM on what information to collect (ID, password)
-# and the format to output the query criteria in before finishing.
-# The format "查询条件：[...]" is crucial for later parsing.
+# Prompt for the query process: instructs the LLM on what information to
+# collect (ID, password) and the JSON object to reply with on every turn.
 query_prompt = """
 您的任务是查询用户信息。您需要从用户那里获得以下信息：
 1.用户ID (例如：用户ID: 10001)
 2.用户设置的密码 (例如：密码: password123)
-如果用户没有提供此信息，则需要提示用户提供。收集完信息后，请明确告知用户您将要查询，并按照以下格式包含查询条件：
-'正在查询... 查询条件：[用户ID: <ID>, 密码: <密码>]'
-然后回复带有 "customer service" 的特殊令牌，以结束任务。（实际查询将在后台完成）
+如果用户没有提供此信息，则需要提示用户提供。
+您的每次回复都必须是一个 JSON 对象。信息收集过程中请回复：
+{"done": false, "message": "<发给用户的回复>"}
+收集完信息后，请将 done 设为 true，并在 info 中包含查询条件以结束任务（实际查询将在后台完成）：
+{"done": true, "message": "正在查询...", "info": {"user_id": <用户ID>, "password": "<密码>"}}
 """
 
-# Prompt for the delete process: instructs the LLM on what info to collect (ID, password, email)
-# and the format to output the deletion criteria in before finishing.
-# The format "删除条件：[...]" is crucial for later parsing.
+# Prompt for the delete process: instructs the LLM on what info to collect
+# (ID, password, email) and the JSON object to reply with on every turn.
 delete_prompt = """
 您的任务是删除用户信息。您需要从用户那里获得以下信息：
 1.用户ID (例如：用户ID: 10001)
 2.用户设置的密码 (例如：密码: password123)
 3.用户的电子邮件地址 (例如：邮箱: zhangsan@example.com)
 如果用户没有提供此信息，则需要提示用户提供该信息。收集完所有信息后，请确认信息并准备删除。
-最后，请明确告知用户将进行删除操作（并模拟发送验证码），并按照以下格式包含条件：
-'将删除用户... 删除条件：[用户ID: <ID>, 密码: <密码>, 邮箱: <邮箱>]'
-然后回复带有 "customer service" 的特殊令牌，以结束任务。（实际删除将在后台完成）
+您的每次回复都必须是一个 JSON 对象。信息收集过程中请回复：
+{"done": false, "message": "<发给用户的回复>"}
+确认完所有信息后，请将 done 设为 true，并在 info 中包含删除条件以结束任务（实际删除将在后台完成）：
+{"done": true, "message": "将删除用户...", "info": {"user_id": <用户ID>, "password": "<密码>", "email": "<邮箱>"}}
 """
 
+# Intern the prompts so every message history references the same string
+# object. Provider-side prompt caching matches on the byte-identical
+# message prefix, so the system prompt must stay exactly the same - and
+# frontmost - across all calls for the KV-cache to be reused.
+sys_prompt = sys.intern(sys_prompt)
+registered_prompt = sys.intern(registered_prompt)
+query_prompt = sys.intern(query_prompt)
+delete_prompt = sys.intern(delete_prompt)
+
+# Fields each task must collect before its simulated DB action can run;
+# used to validate the "info" object of a structured worker reply.
+_TASK_FIELDS = {
+    "registered": ("name", "gender", "age", "password", "email"),
+    "query": ("user_id", "password"),
+    "delete": ("user_id", "password", "email"),
+}
+
+# Control tokens the dispatcher logic scans for. On routing turns the
+# response is streamed and reading stops as soon as one of these arrives,
+# since the tail of the generation would be discarded anyway.
+_TRIGGER_TOKENS = ("registered workers", "query workers", "delete workers", "customer service")
+_MAX_TRIGGER_LEN = max(len(t) for t in _TRIGGER_TOKENS)
+
+# One compiled alternation finds the earliest control token in a single
+# scan of the response, instead of four separate substring tests
+_TRIGGER_RE = re.compile("|".join(re.escape(t) for t in _TRIGGER_TOKENS))
+
+# Optional dependency: pyahocorasick matches all tokens in one pass of a
+# true multi-pattern automaton. With only four fixed literals the
+# compiled alternation performs comparably, so the C extension is used
+# opportunistically when installed.
+try:
+    import ahocorasick
+    _TRIGGER_AUTOMATON = ahocorasick.Automaton()
+    for _tok in _TRIGGER_TOKENS:
+        _TRIGGER_AUTOMATON.add_word(_tok, _tok)
+    _TRIGGER_AUTOMATON.make_automaton()
+except ImportError:
+    _TRIGGER_AUTOMATON = None
+
+def _find_trigger(text, start=0):
+    """Returns the earliest control token in text[start:], or None.
+       Single linear scan via the Aho-Corasick automaton when available,
+       otherwise via the compiled alternation."""
+    if _TRIGGER_AUTOMATON is not None:
+        hit = next(_TRIGGER_AUTOMATON.iter(text, start), None)
+        return hit[1] if hit else None
+    m = _TRIGGER_RE.search(text, start)
+    return m.group(0) if m else None
+
+# Maps each control token to the state it selects ("done" ends the task)
+_TRIGGER_STATES = {
+    "registered workers": "registered",
+    "query workers": "query",
+    "delete workers": "delete",
+    "customer service": "done",
+}
+
+# Maximum number of users kept in the simulated in-memory database.
+# Long-running processes evict the least-recently-used entries beyond
+# this cap so memory stays bounded regardless of uptime.
+_MAX_USERS = 100_000
+
+# Maximum number of internal routing hops (LLM calls) a single user turn
+# may trigger before the agent gives up. A chatty or misrouting model
+# could otherwise loop forever, burning tokens on every iteration.
+_MAX_HOPS = 4
+
+# Maximum number of messages kept in the rolling "system" history
+# (the initial system prompt is always preserved at index 0). Every LLM
+# call resends this history, so capping it bounds per-turn token cost
+# and latency no matter how long the session runs.
+_MAX_SYSTEM_HISTORY = 20
+
 # --- Agent Class Definition ---
 class SmartAssistant:
     """
@@ -88,6 +287,15 @@ class SmartAssistant:
             for user information. Data is lost on restart.
         next_user_id (int): A counter to generate unique user IDs for registration.
     """
+    # Fixed attribute set: __slots__ drops the per-instance __dict__, so
+    # the many self.xxx reads in the get_response loop become C-array
+    # offsets instead of hashtable lookups, and per-session instances
+    # (e.g. one agent per user in a web service) stay small.
+    __slots__ = ("client", "system_prompt", "registered_prompt", "query_prompt",
+                 "delete_prompt", "messages", "current_assignment",
+                 "_sys_msg", "user_database", "by_email", "next_user_id",
+                 "_intent_matrix", "_intent_workers")
+
     def __init__(self):
         """Initializes the SmartAssistant with API client, prompts, message histories,
            initial state, and the simulated database."""
@@ -99,22 +307,87 @@ class SmartAssistant:
         self.query_prompt = query_prompt
         self.delete_prompt = delete_prompt
 
-        # Initialize message history for each state. Each history starts
-        # with the corresponding system prompt.
-        self.messages = {
-            "system": [{"role": "system", "content": self.system_prompt}],
-            "registered": [{"role": "system", "content": self.registered_prompt}],
-            "query": [{"role": "system", "content": self.query_prompt}],
-            "delete": [{"role": "system", "content": self.delete_prompt}]
+        # One shared system-message dict per state, treated as immutable
+        # (never mutated in place). Resetting a finished task's history
+        # becomes a plain dict lookup reusing the same object, instead of
+        # building the attribute name with an f-string, resolving it via
+        # getattr, and allocating a fresh dict each time.
+        self._sys_msg = {
+            "system": {"role": "system", "content": self.system_prompt},
+            "registered": {"role": "system", "content": self.registered_prompt},
+            "query": {"role": "system", "content": self.query_prompt},
+            "delete": {"role": "system", "content": self.delete_prompt}
         }
 
+        # Initialize message history for each state. Each history starts
+        # with the corresponding (shared) system prompt message.
+        self.messages = {state: [msg] for state, msg in self._sys_msg.items()}
+
         # Start in the main "system" state
         self.current_assignment = "system"
 
-        # Initialize the in-memory database and user ID counter
-        self.user_database = {}
+        # Initialize the in-memory database and user ID counter.
+        # An OrderedDict tracks recency so the database can evict its
+        # least-recently-used entries once _MAX_USERS is reached.
+        # by_email is a secondary index (email -> user_id) kept in sync on
+        # register/delete, so email-keyed lookups stay O(1) instead of
+        # scanning user_database.
+        self.user_database = OrderedDict()
+        self.by_email = {}
         self.next_user_id = 10001
 
+        # Semantic routing cache: lazily-built matrix of canonical intent
+        # embeddings (None until first use, False if embeddings are unavailable)
+        self._intent_matrix = None
+        self._intent_workers = None
+
+    # --- Semantic routing helpers ---
+
+    def _embed(self, texts):
+        """Embeds a list of texts and returns a row-normalized numpy matrix."""
+        response = self.client.embeddings.create(model=embed_model, input=list(texts))
+        mat = np.array([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        return mat / np.maximum(norms, 1e-12)
+
+    def _keyword_route(self, user_input):
+        """Routes a "system"-state utterance by keyword match - no network
+           call at all. Returns the worker name when exactly one intent's
+           keywords match, or None (ambiguous or no match) to defer to the
+           semantic cache and the dispatcher LLM."""
+        matches = [worker for worker, pattern in _INTENT_PATTERNS if pattern.search(user_input)]
+        if len(matches) == 1:
+            print(f"[Keyword Route] Matched '{matches[0]}'")
+            return matches[0]
+        return None
+
+    def _semantic_route(self, user_input):
+        """Routes a "system"-state utterance to a worker by embedding similarity.
+
+           Compares the user input against the canonical intent phrasings and
+           returns the mapped worker name when the best cosine similarity
+           clears the threshold. Returns None to fall back to the dispatcher
+           LLM - also when numpy or the embeddings endpoint is unavailable."""
+        if np is None or self._intent_matrix is False:
+            return None
+        try:
+            if self._intent_matrix is None:
+                # Build the canonical embedding matrix on first use
+                self._intent_matrix = self._embed(p for p, _ in _CANONICAL_INTENTS)
+                self._intent_workers = tuple(w for _, w in _CANONICAL_INTENTS)
+            vec = self._embed([user_input])[0]
+            # Rows are normalized, so the dot product is the cosine similarity
+            sims = self._intent_matrix @ vec
+            best = int(np.argmax(sims))
+            if sims[best] >= _SEMANTIC_THRESHOLD:
+                print(f"[Semantic Route] Matched '{self._intent_workers[best]}' (similarity {sims[best]:.2f})")
+                return self._intent_workers[best]
+        except Exception as e:
+            # Embeddings endpoint not usable - disable semantic routing for this session
+            print(f"[Semantic Route] Disabled after error: {e}")
+            self._intent_matrix = False
+        return None
+
     # --- Helper methods for parsing LLM output ---
     # These methods use regular expressions to extract structured data
     # from the LLM's responses when a task is about to finish.
@@ -124,105 +397,122 @@ class SmartAssistant:
            from the LLM response text based on the expected format.
            Returns a dictionary with the info or None if parsing fails."""
         info = {}
-        # Regex patterns to find key-value pairs within the specific format
-        patterns = {
-            "name": r"姓名:\s*(\S+)",
-            "gender": r"性别:\s*(\S+)",
-            "age": r"年龄:\s*(\d+)",
-            "password": r"密码:\s*(\S+)",
-            "email": r"邮箱:\s*(\S+@\S+\.\S+)"
-        }
         # Look for the specific marker "用户信息：[...]"
-        match = re.search(r"用户信息：\[(.*?)\]", text)
-        if not match:
+        data_str = _extract_marked(text, _REG_MARK) # Content within the brackets
+        if data_str is None:
             print(f"[Parsing Error] Registration marker not found in: {text}")
             return None
-        data_str = match.group(1) # Extract the content within brackets
-
-        # Extract each piece of information using regex
-        for key, pattern in patterns.items():
-            m = re.search(pattern, data_str)
-            if m:
-                info[key] = m.group(1)
-            else:
-                # If any piece is missing, parsing fails
-                print(f"[Parsing Error] Missing '{key}' in registration info: {data_str}")
-                return None
 
-        # Convert age to integer, handle potential errors
-        if 'age' in info:
-            try:
-                info['age'] = int(info['age'])
-            except ValueError:
-                 print(f"[Parsing Error] Invalid age format: {info['age']}")
-                 return None
+        # Fast path: one combined pattern extracts all fields in prompt order
+        m = _REG_ALL.search(data_str)
+        if m:
+            info = m.groupdict()
+        else:
+            # Fallback: search field by field, tolerating reordered fields
+            for key, pattern in _REG_FIELDS:
+                m = pattern.search(data_str)
+                if m:
+                    info[key] = m.group(1)
+                else:
+                    # If any piece is missing, parsing fails
+                    print(f"[Parsing Error] Missing '{key}' in registration info: {data_str}")
+                    return None
+
+        # The age pattern only matches ASCII digits, so int() cannot fail here
+        info['age'] = int(info['age'])
         return info
 
     def _parse_query_info(self, text):
         """Parses query details (user_id, password) from the LLM response.
            Returns a dictionary or None if parsing fails."""
         info = {}
-        patterns = {
-            "user_id": r"用户ID:\s*(\d+)",
-            "password": r"密码:\s*(\S+)",
-        }
         # Look for the marker "查询条件：[...]"
-        match = re.search(r"查询条件：\[(.*?)\]", text)
-        if not match:
+        data_str = _extract_marked(text, _QUERY_MARK)
+        if data_str is None:
             print(f"[Parsing Error] Query marker not found in: {text}")
             return None
-        data_str = match.group(1)
-
-        for key, pattern in patterns.items():
-            m = re.search(pattern, data_str)
-            if m:
-                info[key] = m.group(1)
-            else:
-                print(f"[Parsing Error] Missing '{key}' in query info: {data_str}")
-                return None
 
-        # Convert user_id to integer
-        if 'user_id' in info:
-             try:
-                info['user_id'] = int(info['user_id'])
-             except ValueError:
-                 print(f"[Parsing Error] Invalid user_id format: {info['user_id']}")
-                 return None
+        # Fast path: one combined pattern extracts all fields in prompt order
+        m = _QUERY_ALL.search(data_str)
+        if m:
+            info = m.groupdict()
+        else:
+            # Fallback: search field by field, tolerating reordered fields
+            for key, pattern in _QUERY_FIELDS:
+                m = pattern.search(data_str)
+                if m:
+                    info[key] = m.group(1)
+                else:
+                    print(f"[Parsing Error] Missing '{key}' in query info: {data_str}")
+                    return None
+
+        # The user_id pattern only matches ASCII digits, so int() cannot fail here
+        info['user_id'] = int(info['user_id'])
         return info
 
     def _parse_delete_info(self, text):
         """Parses deletion details (user_id, password, email) from the LLM response.
            Returns a dictionary or None if parsing fails."""
         info = {}
-        patterns = {
-            "user_id": r"用户ID:\s*(\d+)",
-            "password": r"密码:\s*(\S+)",
-            "email": r"邮箱:\s*(\S+@\S+\.\S+)"
-        }
         # Look for the marker "删除条件：[...]"
-        match = re.search(r"删除条件：\[(.*?)\]", text)
-        if not match:
+        data_str = _extract_marked(text, _DELETE_MARK)
+        if data_str is None:
             print(f"[Parsing Error] Delete marker not found in: {text}")
             return None
-        data_str = match.group(1)
-
-        for key, pattern in patterns.items():
-            m = re.search(pattern, data_str)
-            if m:
-                info[key] = m.group(1)
-            else:
-                print(f"[Parsing Error] Missing '{key}' in delete info: {data_str}")
-                return None
 
-        # Convert user_id to integer
-        if 'user_id' in info:
-             try:
-                info['user_id'] = int(info['user_id'])
-             except ValueError:
-                 print(f"[Parsing Error] Invalid user_id format: {info['user_id']}")
-                 return None
+        # Fast path: one combined pattern extracts all fields in prompt order
+        m = _DELETE_ALL.search(data_str)
+        if m:
+            info = m.groupdict()
+        else:
+            # Fallback: search field by field, tolerating reordered fields
+            for key, pattern in _DELETE_FIELDS:
+                m = pattern.search(data_str)
+                if m:
+                    info[key] = m.group(1)
+                else:
+                    print(f"[Parsing Error] Missing '{key}' in delete info: {data_str}")
+                    return None
+
+        # The user_id pattern only matches ASCII digits, so int() cannot fail here
+        info['user_id'] = int(info['user_id'])
         return info
 
+    # --- Helper methods for structured (JSON) worker replies ---
+
+    def _parse_structured(self, text):
+        """Parses a worker-state reply as a JSON object.
+           Returns the parsed dict, or None when the reply is not a JSON
+           object so the caller can fall back to the legacy marker format."""
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    def _coerce_info(self, task, info):
+        """Validates the "info" object of a structured worker reply against
+           the fields the task requires. Converts numeric fields to int.
+           Returns the cleaned dict, or None if anything is missing/invalid."""
+        if not isinstance(info, dict):
+            print(f"[Parsing Error] Structured info is not an object: {info}")
+            return None
+        cleaned = {}
+        for key in _TASK_FIELDS[task]:
+            if key not in info:
+                print(f"[Parsing Error] Missing '{key}' in structured info: {info}")
+                return None
+            value = info[key]
+            # age and user_id must be integers
+            if key in ("age", "user_id"):
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    print(f"[Parsing Error] Invalid {key} in structured info: {value}")
+                    return None
+            cleaned[key] = value
+        return cleaned
+
     # --- Helper methods for simulated database operations ---
     # These methods interact with the in-memory `self.user_database` dictionary.
 
@@ -237,7 +527,13 @@ class SmartAssistant:
             "password": info["password"], # WARNING: In a real app, hash the password!
             "email": info["email"]
         }
+        self.by_email[info["email"]] = user_id # Keep the email index in sync
         self.next_user_id += 1 # Increment for the next user
+        # Evict the least-recently-used user once the cap is reached,
+        # keeping the email index consistent
+        if len(self.user_database) > _MAX_USERS:
+            _, evicted_info = self.user_database.popitem(last=False)
+            self.by_email.pop(evicted_info["email"], None)
         print(f"[DB Action] Registered User ID: {user_id}, Info: {self.user_database[user_id]}")
         return user_id
 
@@ -248,6 +544,7 @@ class SmartAssistant:
         user_info = self.user_database.get(user_id)
         # Check if user exists and password matches
         if user_info and user_info["password"] == password:
+            self.user_database.move_to_end(user_id) # Active users stay hot in the LRU
             print(f"[DB Action] Query Success for User ID: {user_id}")
             # Return user info, but exclude the password for security
             return {k: v for k, v in user_info.items() if k != 'password'}
@@ -255,6 +552,11 @@ class SmartAssistant:
             print(f"[DB Action] Query Failed for User ID: {user_id}")
             return None
 
+    def _query_by_email(self, email):
+        """Looks up a user ID by email via the secondary index.
+           Returns the user ID, or None if the email is not registered."""
+        return self.by_email.get(email)
+
     def _delete_user(self, user_id, password, email):
         """Deletes a user from the simulated database if ID, password, and email match.
            Returns True if deletion was successful, False otherwise."""
@@ -262,12 +564,78 @@ class SmartAssistant:
         # Check if user exists and all credentials match
         if user_info and user_info["password"] == password and user_info["email"] == email:
             del self.user_database[user_id]
+            self.by_email.pop(user_info["email"], None) # Keep the email index in sync
             print(f"[DB Action] Deleted User ID: {user_id}")
             return True
         else:
             print(f"[DB Action] Delete Failed for User ID: {user_id}")
             return False
 
+    # --- Task completion helpers ---
+
+    def _finish_task(self, task, parsed_info):
+        """Runs the simulated DB action for a completed task.
+           Returns the extra message describing the action's outcome."""
+        if task == "registered":
+            if parsed_info:
+                new_user_id = self._register_user(parsed_info)
+                # Add the new user ID to the confirmation message
+                return f" (您的用户 ID 是: {new_user_id})"
+            return " (错误：注册信息解析失败，未能存储用户)"
+        elif task == "query":
+            if parsed_info:
+                user_data = self._query_user(parsed_info["user_id"], parsed_info["password"])
+                if user_data:
+                    # Append the found user data to the message
+                    return f" \n查询成功！您的信息如下： {user_data}"
+                return " \n查询失败：用户ID或密码错误。"
+            return " (错误：查询信息解析失败)"
+        elif task == "delete":
+            if parsed_info:
+                deleted = self._delete_user(parsed_info["user_id"], parsed_info["password"], parsed_info["email"])
+                if deleted:
+                    return " \n用户删除成功！"
+                return " \n删除失败：用户信息不匹配。"
+            return " (错误：删除信息解析失败)"
+        return ""
+
+    def _complete_task(self, ai_response, parsed_info, current_messages):
+        """Finishes the current worker task: runs the simulated DB action,
+           folds the task history into the main history, resets the task
+           state, and returns the final response text for the user."""
+        previous_assignment = self.current_assignment # The task that finished
+        db_action_result_msg = self._finish_task(previous_assignment, parsed_info)
+
+        print(f"[State Transition] Task '{previous_assignment}' finished. Returning to 'system'.")
+        # Append the final AI response (with the DB result) to the finished task's history
+        current_messages.append({"role": "assistant", "content": ai_response + db_action_result_msg})
+        # Fold the completed task into the main history as a single
+        # compacted entry. The SDK re-serializes every message dict on each
+        # API call, so one bounded-size entry (each turn truncated to 400
+        # chars) keeps the per-call JSON-encoding work and the bytes on the
+        # wire constant per completed task, instead of growing with the
+        # number of message dicts carried over.
+        compacted = json.dumps(
+            [{"role": m["role"], "c": m["content"][:400]} for m in current_messages[1:]],
+            ensure_ascii=False
+        )
+        self.messages["system"].append({
+            "role": "system",
+            "content": f"[已完成 {previous_assignment} 任务，对话摘要：{compacted}]"
+        })
+        # Cap the rolling history, always preserving the system prompt
+        if len(self.messages["system"]) > _MAX_SYSTEM_HISTORY:
+            self.messages["system"] = (
+                self.messages["system"][:1]
+                + self.messages["system"][-(_MAX_SYSTEM_HISTORY - 1):]
+            )
+        # Reset the task-specific history, keeping only the (shared) system prompt
+        self.messages[previous_assignment] = [self._sys_msg[previous_assignment]]
+        # Switch state back to system
+        self.current_assignment = "system"
+        # Return the final combined response to the user
+        return ai_response + db_action_result_msg
+
     # --- Core Agent Logic ---
     def get_response(self, user_input):
         """Processes user input, interacts with the LLM, manages state transitions,
@@ -279,86 +647,127 @@ class SmartAssistant:
         Returns:
             str: The agent's response to the user.
         """
+        # The system prompt must remain frontmost and untouched so the
+        # provider-side prompt cache keeps hitting on the prefix; the history
+        # folding below only ever appends or trims the tail.
+        assert self.messages["system"][0]["content"] is self.system_prompt
+
         # Get the message history for the current state
         current_messages = self.messages[self.current_assignment]
         # Add the latest user input to the history
         current_messages.append({"role": "user", "content": user_input})
-
-        # Loop allows for potential internal state changes without returning immediately
-        while True:
-            # Call the LLM API
-            response = self.client.chat.completions.create(
-                model=chat_model,
-                messages=current_messages, # Use history for the current state
-                temperature=0.7, # Lower temperature for more deterministic behavior needed for parsing
-                stream=False,
-                max_tokens=2000,
-            )
-
-            # Extract the LLM's response text
-            ai_response = response.choices[0].message.content
-
-            # --- State Transition & Action Logic --- #
+        # Worker histories get the same bound as the rolling "system"
+        # history: trim the oldest turns (in place, keeping the system
+        # prompt at index 0) so marathon collection dialogs cannot grow
+        # the per-call prompt without limit.
+        if len(current_messages) > _MAX_SYSTEM_HISTORY:
+            del current_messages[1:len(current_messages) - (_MAX_SYSTEM_HISTORY - 1)]
+
+        # On routing turns, try the local tiers first - keywords (free),
+        # then the semantic cache (one embedding call) - so a clear intent
+        # routes to its worker without a dispatcher LLM call.
+        routed_worker = None
+        if self.current_assignment == "system":
+            routed_worker = self._keyword_route(user_input) or self._semantic_route(user_input)
+
+        # Loop allows for potential internal state changes without returning
+        # immediately; bounded so a misbehaving model cannot livelock a turn
+        for _hop in range(_MAX_HOPS):
+            ai_response = None
+            if routed_worker:
+                # Synthesize the dispatcher reply (including the trigger token)
+                # so the normal state-transition logic below takes over.
+                ai_response = f"好的，已识别您的请求，正在为您调用对应的业务流程（{routed_worker} workers）。"
+                routed_worker = None # Only short-circuit the first hop
+
+            # Check the exact-match cache for routing turns before calling the API.
+            # Worker states are never cached: their replies depend on task progress.
+            cache_key = None
+            if ai_response is None:
+                cache_key = _cache_key(current_messages) if self.current_assignment == "system" else None
+                ai_response = _LLM_CACHE.get(cache_key) if cache_key else None
+
+            if ai_response is None:
+                # Worker states must reply with a JSON object (see the worker
+                # prompts); ask the API to enforce that where supported.
+                extra_kwargs = {}
+                if self.current_assignment != "system":
+                    extra_kwargs["response_format"] = {"type": "json_object"}
+                # Call the LLM API, streaming the response so routing turns
+                # can stop reading as soon as a control token appears
+                stream = self.client.chat.completions.create(
+                    model=chat_model,
+                    messages=current_messages, # Use history for the current state
+                    temperature=0.7, # Lower temperature for more deterministic behavior needed for parsing
+                    stream=True,
+                    max_tokens=2000,
+                    timeout=30.0, # Don't let a hung socket stall the turn
+
+                    **extra_kwargs,
+                )
+
+                # Accumulate the streamed deltas into the response text
+                buf = ""
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    if not delta:
+                        continue
+                    # A token may straddle two deltas, so rescan from just
+                    # before the previous end of the buffer
+                    scan_from = max(0, len(buf) - _MAX_TRIGGER_LEN)
+                    buf += delta
+                    # Early abort applies only to routing turns; worker states
+                    # need their complete JSON object.
+                    if self.current_assignment == "system" and _find_trigger(buf, scan_from):
+                        stream.close() # Stop generating - the tail is unused
+                        break
+                ai_response = buf
+                # Store routing responses for reuse on identical future turns
+                if cache_key:
+                    _LLM_CACHE[cache_key] = ai_response
+
+            # --- Structured Worker Replies --- #
+            # Worker states respond with a JSON object; handle that first and
+            # only fall back to the legacy token/marker protocol if parsing fails.
+            if self.current_assignment != "system":
+                structured = self._parse_structured(ai_response)
+                if structured is not None:
+                    display = str(structured.get("message", "")) or ai_response
+                    if structured.get("done"):
+                        # Task declared finished: validate the info and run the DB action
+                        parsed_info = self._coerce_info(self.current_assignment, structured.get("info"))
+                        return self._complete_task(display, parsed_info, current_messages)
+                    # Regular collection turn: show the message and wait for the user
+                    current_messages.append({"role": "assistant", "content": display})
+                    return display
+
+            # --- State Transition & Action Logic (legacy token protocol) --- #
+
+            # One scan of the response finds the earliest control token
+            token = _find_trigger(ai_response)
+            trigger = _TRIGGER_STATES[token] if token else None
 
             # Check if the response indicates a switch to a specific worker (business process)
             next_assignment = None
-            if "registered workers" in ai_response:
-                next_assignment = "registered"
-            elif "query workers" in ai_response:
-                next_assignment = "query"
-            elif "delete workers" in ai_response:
-                next_assignment = "delete"
+            if trigger in ("registered", "query", "delete"):
+                next_assignment = trigger
 
             # Check if the response indicates returning to the main customer service state
-            elif "customer service" in ai_response:
-                # This means the current task (e.g., registration) is finishing.
-                # We need to parse the final response and perform the DB action.
-                db_action_result_msg = "" # Additional message based on DB result
-                previous_assignment = self.current_assignment # Remember which task finished
-
-                # Perform action based on the completed task
+            elif trigger == "done":
+                # Legacy completion path: the model ignored the JSON
+                # instruction, so parse the marker format and finish the task.
+                previous_assignment = self.current_assignment
                 if previous_assignment == "registered":
                     parsed_info = self._parse_registration_info(ai_response)
-                    if parsed_info:
-                        new_user_id = self._register_user(parsed_info)
-                        # Add the new user ID to the confirmation message
-                        db_action_result_msg = f" (您的用户 ID 是: {new_user_id})"
-                    else:
-                        db_action_result_msg = " (错误：注册信息解析失败，未能存储用户)"
                 elif previous_assignment == "query":
                     parsed_info = self._parse_query_info(ai_response)
-                    if parsed_info:
-                        user_data = self._query_user(parsed_info["user_id"], parsed_info["password"])
-                        if user_data:
-                            # Append the found user data to the message
-                            db_action_result_msg = f" \n查询成功！您的信息如下： {user_data}"
-                        else:
-                            db_action_result_msg = " \n查询失败：用户ID或密码错误。"
-                    else:
-                        db_action_result_msg = " (错误：查询信息解析失败)"
                 elif previous_assignment == "delete":
-                     parsed_info = self._parse_delete_info(ai_response)
-                     if parsed_info:
-                         deleted = self._delete_user(parsed_info["user_id"], parsed_info["password"], parsed_info["email"])
-                         if deleted:
-                             db_action_result_msg = " \n用户删除成功！"
-                         else:
-                             db_action_result_msg = " \n删除失败：用户信息不匹配。"
-                     else:
-                         db_action_result_msg = " (错误：删除信息解析失败)"
-
-                print(f"[State Transition] Task '{previous_assignment}' finished. Returning to 'system'.")
-                # Append the final AI response (potentially modified with DB result) to the finished task's history
-                current_messages.append({"role": "assistant", "content": ai_response + db_action_result_msg})
-                # Merge the completed task's conversation history (excluding the initial system prompt)
-                # into the main system history to maintain context for future interactions.
-                self.messages["system"].extend(current_messages[1:])
-                # Optional: Reset the task-specific history to save memory, keeping only the system prompt
-                self.messages[previous_assignment] = [{"role": "system", "content": getattr(self, f"{previous_assignment}_prompt")}]
-                # Switch state back to system
-                self.current_assignment = "system"
-                # Return the final combined response to the user
-                return ai_response + db_action_result_msg
+                    parsed_info = self._parse_delete_info(ai_response)
+                else:
+                    parsed_info = None
+                return self._complete_task(ai_response, parsed_info, current_messages)
 
             # --- Handle State Transitions TO Workers ---
             if next_assignment:
@@ -385,6 +794,9 @@ class SmartAssistant:
                 # Return the response to the user.
                 return ai_response
 
+        # Every hop produced another state transition without a final reply
+        raise RuntimeError(f"intent routing did not converge within {_MAX_HOPS} hops")
+
     # --- Conversation Loop ---
     def start_conversation(self):
         """Starts the interactive command-line conversation loop with the user."""